@@ -1,15 +1,26 @@
+import calendar
 import json
+import mmap
 import os
-from datetime import datetime, timedelta
+import sys
+from datetime import date, datetime, timedelta
 from collections import defaultdict
 import glob
+import heapq
+
+try:
+    import orjson  # Optional, much faster JSON parser
+except ImportError:
+    orjson = None
 
 class SpotifyAnalyzer:
     def __init__(self, data_folder):
         self.data_folder = data_folder
         self.streams = []
+        self.song_keys = []  # Song key for each stream['_id']
         self.session_gap_minutes = 30
         self.completion_threshold = 0.90  # 90% = considered complete
+        self._metrics = None  # Cached result of compute_all_metrics()
         
     def load_streaming_history(self):
         """Load all StreamingHistory*.json files"""
@@ -17,171 +28,232 @@ class SpotifyAnalyzer:
         files = glob.glob(pattern)
         
         print(f"Found {len(files)} streaming history files")
+        self._metrics = None
         
+        # One file at a time, so only one unfiltered file is ever in memory
         for file in sorted(files):
-            with open(file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                self.streams.extend(data)
-        
-        # Filter from December 2024 onwards
-        cutoff = datetime(2024, 12, 1)
-        self.streams = [s for s in self.streams if datetime.strptime(s['endTime'], '%Y-%m-%d %H:%M') >= cutoff]
+            self.streams.extend(self._load_file(file))
         
         # Sort by timestamp
         self.streams.sort(key=lambda x: x['endTime'])
         
+        # Parse timestamps once with the C ISO parser ('YYYY-MM-DD HH:MM');
+        # streams are sorted, so repeats of the same minute are adjacent
+        prev_end = dt = None
+        songs = {}  # Song key -> id, in order of first appearance
+        song_keys = []  # Canonical key for each id
+        
+        # Bind per-stream callables to locals outside the loop
+        fromisoformat = datetime.fromisoformat
+        get_song_key = self.get_song_key
+        
+        for s in self.streams:
+            # Fill missing fields once so later passes can index directly
+            s.setdefault('msPlayed', 0)
+            s.setdefault('trackName', 'Unknown')
+            s.setdefault('artistName', 'Unknown')
+            
+            end_time = s['endTime']
+            if end_time != prev_end:
+                dt = fromisoformat(end_time)
+                minute = dt.toordinal() * 1440 + dt.hour * 60 + dt.minute
+                prev_end = end_time
+            
+            # The analysis pass derives day/week/month from this one int
+            s['_minute'] = minute  # Whole minutes since 0001-01-01
+            
+            # Number songs so the analysis pass can index flat lists; the
+            # first key seen for each song is the one reported everywhere,
+            # and its name strings replace each stream's own copies
+            key = get_song_key(s)
+            song_id = songs.get(key)
+            if song_id is None:
+                song_id = songs[key] = len(songs)
+                song_keys.append(key)
+            s['_id'] = song_id
+            s['trackName'], s['artistName'] = song_keys[song_id]
+        
+        self.song_keys = song_keys
+        
         print(f"Loaded {len(self.streams)} streams from December 2024 onwards")
         
+    @staticmethod
+    def _load_file(file):
+        """Load one history file, keeping streams from December 2024 onwards"""
+        # endTime strings sort chronologically, so compare them directly
+        cutoff = '2024-12-01 00:00'
+        
+        with open(file, 'rb') as f:
+            if orjson is None or os.fstat(f.fileno()).st_size == 0:
+                data = json.load(f)
+            else:
+                # Parse straight from the page cache instead of copying the file
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                        mm.madvise(mmap.MADV_SEQUENTIAL)
+                    with memoryview(mm) as buf:
+                        data = orjson.loads(buf)
+        
+        return [s for s in data if s['endTime'] >= cutoff]
+    
     def get_song_key(self, stream):
         """Create unique key for song"""
         track = stream.get('trackName', 'Unknown')
         artist = stream.get('artistName', 'Unknown')
-        return f"{track}|||{artist}"
+        return (track, artist)
     
-    def analyze_basic_metrics(self):
-        """Calculate play counts and total minutes"""
-        song_stats = defaultdict(lambda: {
-            'play_count': 0,
-            'total_ms': 0,
-            'track_name': '',
-            'artist_name': ''
-        })
+    def compute_all_metrics(self):
+        """Calculate every per-song metric in a single pass over the streams"""
+        if self._metrics is not None:
+            return self._metrics
+        
+        # Per-song counters live in flat lists indexed by stream['_id']
+        song_keys = self.song_keys
+        n_songs = len(song_keys)
+        play_counts = [0] * n_songs
+        total_ms = [0] * n_songs
+        session_counts = [0] * n_songs
+        completed_plays = [0] * n_songs
+        daily_listens = [defaultdict(int) for _ in range(n_songs)]
+        song_weeks = [0] * n_songs  # Bitmaps of weeks/months with a play
+        song_months = [0] * n_songs
+        monthly_counts = [defaultdict(int) for _ in range(n_songs)]
+        
+        session_gap = self.session_gap_minutes
+        prev_minute = prev_day = first_year = None
         
         for stream in self.streams:
-            key = self.get_song_key(stream)
-            song_stats[key]['play_count'] += 1
-            song_stats[key]['total_ms'] += stream.get('msPlayed', 0)
+            song_id = stream['_id']
+            ms_played = stream['msPlayed']
+            minute = stream['_minute']
+            day = minute // 1440  # Day ordinal
             
-            # Store names
-            if not song_stats[key]['track_name']:
-                song_stats[key]['track_name'] = stream.get('trackName', 'Unknown')
-                song_stats[key]['artist_name'] = stream.get('artistName', 'Unknown')
-        
-        return song_stats
-    
-    def detect_session_starters(self):
-        """Find songs that start listening sessions"""
-        session_starters = defaultdict(int)
-        
-        for i, stream in enumerate(self.streams):
-            if i == 0:
-                # First song is a session starter
-                key = self.get_song_key(stream)
-                session_starters[key] += 1
-                continue
+            # Calendar fields only change with the day. Week/month bits are
+            # counted from the first (earliest) year; a week is the calendar
+            # year + ISO week number
+            if day != prev_day:
+                day_date = date.fromordinal(day)
+                if first_year is None:
+                    first_year = day_date.year
+                years = day_date.year - first_year
+                week_bit = 1 << (years * 53 + day_date.isocalendar()[1] - 1)
+                month_bit = 1 << (years * 12 + day_date.month - 1)
+                prev_day = day
             
-            # Check time gap from previous song
-            current_time = datetime.strptime(stream['endTime'], '%Y-%m-%d %H:%M')
-            prev_time = datetime.strptime(self.streams[i-1]['endTime'], '%Y-%m-%d %H:%M')
+            # Play counts and total minutes
+            play_counts[song_id] += 1
+            total_ms[song_id] += ms_played
             
-            gap = (current_time - prev_time).total_seconds() / 60  # minutes
-            
-            if gap >= self.session_gap_minutes:
-                key = self.get_song_key(stream)
-                session_starters[key] += 1
-        
-        print(f"Detected {sum(session_starters.values())} listening sessions")
-        return session_starters
-    
-    def calculate_completion_rates(self):
-        """Calculate how often songs are played to completion"""
-        song_completions = defaultdict(lambda: {
-            'total_plays': 0,
-            'completed_plays': 0,
-            'skipped_plays': 0,
-            'completion_rate': 0.0
-        })
-        
-        for stream in self.streams:
-            key = self.get_song_key(stream)
-            ms_played = stream.get('msPlayed', 0)
-            
-            song_completions[key]['total_plays'] += 1
+            # First song, or first after a long enough gap, starts a session
+            if prev_minute is None or minute - prev_minute >= session_gap:
+                session_counts[song_id] += 1
+            prev_minute = minute
             
             # Consider it completed if played for more than 90 seconds
             if ms_played > 90000:  # 90 seconds
-                song_completions[key]['completed_plays'] += 1
-            else:
-                song_completions[key]['skipped_plays'] += 1
-        
-        # Calculate rates
-        for key in song_completions:
-            stats = song_completions[key]
-            if stats['total_plays'] > 0:
-                stats['completion_rate'] = stats['completed_plays'] / stats['total_plays']
-        
-        return song_completions
-    
-    def calculate_listening_density(self):
-        """Calculate how many days had multiple listens of same song"""
-        daily_listens = defaultdict(lambda: defaultdict(int))
+                completed_plays[song_id] += 1
+            
+            # Listens per day
+            daily_listens[song_id][day] += 1
+            
+            # Weeks and months the song appeared in
+            song_weeks[song_id] |= week_bit
+            song_months[song_id] |= month_bit
+            monthly_counts[song_id][day_date.month] += 1  # Month of year
         
-        for stream in self.streams:
-            key = self.get_song_key(stream)
-            date = datetime.strptime(stream['endTime'], '%Y-%m-%d %H:%M').date()
-            daily_listens[key][date] += 1
+        print(f"Detected {sum(session_counts)} listening sessions")
         
+        song_stats = {}
+        session_starters = {}
+        song_completions = {}
         density_scores = {}
         density_details = {}
-        for song_key, dates in daily_listens.items():
+        consistency_scores = {}
+        consistency_details = {}
+        song_monthly_counts = {}
+        for song_id, key in enumerate(song_keys):
+            plays = play_counts[song_id]
+            completed = completed_plays[song_id]
+            song_stats[key] = {
+                'play_count': plays,
+                'total_ms': total_ms[song_id],
+                'track_name': key[0],
+                'artist_name': key[1]
+            }
+            if session_counts[song_id]:
+                session_starters[key] = session_counts[song_id]
+            song_completions[key] = {
+                'total_plays': plays,
+                'completed_plays': completed,
+                'skipped_plays': plays - completed,
+                'completion_rate': completed / plays if plays > 0 else 0.0
+            }
+            
             # Count days with 2+ listens (shows obsession)
+            dates = daily_listens[song_id]
             multi_listen_days = sum(1 for count in dates.values() if count >= 2)
-            max_in_one_day = max(dates.values()) if dates else 0
-            density_scores[song_key] = multi_listen_days
-            density_details[song_key] = {
+            density_scores[key] = multi_listen_days
+            density_details[key] = {
                 'multi_listen_days': multi_listen_days,
-                'max_in_one_day': max_in_one_day
+                'max_in_one_day': max(dates.values()) if dates else 0
             }
-        
-        return density_scores, density_details
+            
+            weeks = bin(song_weeks[song_id]).count('1')
+            consistency_scores[key] = weeks
+            consistency_details[key] = {
+                'weeks': weeks,
+                'months': bin(song_months[song_id]).count('1')
+            }
+            song_monthly_counts[key] = monthly_counts[song_id]
+        
+        self._metrics = {
+            'basic_stats': song_stats,
+            'session_starters': session_starters,
+            'completion_rates': song_completions,
+            'density_scores': density_scores,
+            'density_details': density_details,
+            'consistency_scores': consistency_scores,
+            'consistency_details': consistency_details,
+            'song_monthly_counts': song_monthly_counts
+        }
+        return self._metrics
+    
+    def analyze_basic_metrics(self):
+        """Calculate play counts and total minutes"""
+        return self.compute_all_metrics()['basic_stats']
+    
+    def detect_session_starters(self):
+        """Find songs that start listening sessions"""
+        return self.compute_all_metrics()['session_starters']
+    
+    def calculate_completion_rates(self):
+        """Calculate how often songs are played to completion"""
+        return self.compute_all_metrics()['completion_rates']
+    
+    def calculate_listening_density(self):
+        """Calculate how many days had multiple listens of same song"""
+        metrics = self.compute_all_metrics()
+        return metrics['density_scores'], metrics['density_details']
     
     def calculate_consistency(self):
         """Calculate how many different weeks/months song appeared in"""
-        song_weeks = defaultdict(set)
-        song_months = defaultdict(set)
-        
-        for stream in self.streams:
-            key = self.get_song_key(stream)
-            date = datetime.strptime(stream['endTime'], '%Y-%m-%d %H:%M')
-            week = f"{date.year}-W{date.isocalendar()[1]}"
-            month = f"{date.year}-{date.month:02d}"
-            song_weeks[key].add(week)
-            song_months[key].add(month)
-        
-        consistency_scores = {k: len(v) for k, v in song_weeks.items()}
-        consistency_details = {k: {
-            'weeks': len(song_weeks[k]),
-            'months': len(song_months[k])
-        } for k in song_weeks.keys()}
-        
-        return consistency_scores, consistency_details
+        metrics = self.compute_all_metrics()
+        return metrics['consistency_scores'], metrics['consistency_details']
     
     def find_peak_month(self, song_key):
         """Find which month had the most listens for a song"""
-        monthly_counts = defaultdict(int)
-        
-        for stream in self.streams:
-            key = self.get_song_key(stream)
-            if key == song_key:
-                date = datetime.strptime(stream['endTime'], '%Y-%m-%d %H:%M')
-                month = date.strftime('%B')  # Full month name
-                monthly_counts[month] += 1
+        monthly_counts = self.compute_all_metrics()['song_monthly_counts'].get(song_key)
         
         if monthly_counts:
             peak_month = max(monthly_counts, key=monthly_counts.get)
             peak_count = monthly_counts[peak_month]
-            return peak_month, peak_count
+            return calendar.month_name[peak_month], peak_count
         return None, 0
     
     def calculate_weighted_score(self, song_key, basic_stats, session_starters, 
-                                 completion_rates, density_scores, consistency_scores):
-        """Calculate weighted score for a song"""
-        
-        # Normalize factors (0-1 scale)
-        max_minutes = max(s['total_ms'] for s in basic_stats.values()) / 60000
-        max_sessions = max(session_starters.values()) if session_starters else 1
-        max_density = max(density_scores.values()) if density_scores else 1
-        max_consistency = max(consistency_scores.values()) if consistency_scores else 1
+                                 completion_rates, density_scores, consistency_scores,
+                                 max_minutes, max_sessions, max_density, max_consistency):
+        """Calculate weighted score for a song, normalized by the given maxima"""
         
         # Get song metrics
         minutes = basic_stats[song_key]['total_ms'] / 60000
@@ -287,10 +359,18 @@ class SpotifyAnalyzer:
         # Calculate weighted scores
         weighted_scores = {}
         score_components = {}
+        
+        # Normalize factors (0-1 scale)
+        max_minutes = max(s['total_ms'] for s in basic_stats.values()) / 60000 if basic_stats else 1
+        max_sessions = max(session_starters.values()) if session_starters else 1
+        max_density = max(density_scores.values()) if density_scores else 1
+        max_consistency = max(consistency_scores.values()) if consistency_scores else 1
+        
         for song_key in filtered_songs:
             scores = self.calculate_weighted_score(
                 song_key, basic_stats, session_starters, 
-                completion_rates, density_scores, consistency_scores
+                completion_rates, density_scores, consistency_scores,
+                max_minutes, max_sessions, max_density, max_consistency
             )
             weighted_scores[song_key] = scores['total']
             score_components[song_key] = scores
@@ -331,10 +411,11 @@ class SpotifyAnalyzer:
                      completion_rates=None, density_details=None, 
                      consistency_details=None, show_detailed_scores=False):
         """Print a ranking table with detailed insights"""
-        print(f"\n{title}")
-        print("-" * 80)
+        # Build the whole table and write it in one call
+        parts = [f"\n{title}\n", "-" * 80, "\n"]
         
-        sorted_songs = sorted(songs.keys(), key=sort_key, reverse=True)[:limit]
+        # Partial sort: same order as sorted(..., reverse=True)[:limit]
+        sorted_songs = heapq.nlargest(limit, songs.keys(), key=sort_key)
         
         for i, song_key in enumerate(sorted_songs, 1):
             stats = basic_stats[song_key]
@@ -344,29 +425,31 @@ class SpotifyAnalyzer:
             minutes = stats['total_ms'] / 60000
             
             # Main info line
-            print(f"\n{i:2d}. {track[:45]:<45} - {artist[:25]:<25}")
-            print(f"    ♫ {plays:3d} plays | {minutes:6.1f} min", end="")
+            parts.append(f"\n{i:2d}. {track[:45]:<45} - {artist[:25]:<25}\n")
+            parts.append(f"    ♫ {plays:3d} plays | {minutes:6.1f} min")
             
             # Add session starters and completion rate
             if session_starters:
                 sessions = session_starters.get(song_key, 0)
-                print(f" | ▶ {sessions} sessions", end="")
+                parts.append(f" | ▶ {sessions} sessions")
             
             if completion_rates:
                 comp_rate = completion_rates.get(song_key, {}).get('completion_rate', 0)
-                print(f" | ✓ {comp_rate:.0%} completed", end="")
+                parts.append(f" | ✓ {comp_rate:.0%} completed")
             
-            print()  # New line
+            parts.append("\n")
             
             # Show detailed score breakdown for weighted ranking
             if show_detailed_scores and score_components:
                 components = score_components[song_key]
-                print(f"    📊 Score: {components['total']:.3f} = ", end="")
-                print(f"Minutes({components['minutes']:.2f}×0.25) + ", end="")
-                print(f"Sessions({components['sessions']:.2f}×0.30) + ", end="")
-                print(f"Completion({components['completion']:.2f}×0.25) + ", end="")
-                print(f"Density({components['density']:.2f}×0.15) + ", end="")
-                print(f"Consistency({components['consistency']:.2f}×0.05)")
+                parts.append(
+                    f"    📊 Score: {components['total']:.3f} = "
+                    f"Minutes({components['minutes']:.2f}×0.25) + "
+                    f"Sessions({components['sessions']:.2f}×0.30) + "
+                    f"Completion({components['completion']:.2f}×0.25) + "
+                    f"Density({components['density']:.2f}×0.15) + "
+                    f"Consistency({components['consistency']:.2f}×0.05)\n"
+                )
             
             # Fun fact
             if session_starters and completion_rates and density_details and consistency_details:
@@ -374,7 +457,9 @@ class SpotifyAnalyzer:
                     song_key, basic_stats, session_starters, 
                     completion_rates, density_details, consistency_details
                 )
-                print(f"    💡 {fun_fact}")
+                parts.append(f"    💡 {fun_fact}\n")
+        
+        sys.stdout.write("".join(parts))
 
 # Usage
 if __name__ == "__main__":